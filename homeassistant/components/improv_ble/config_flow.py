@@ -4,8 +4,9 @@ from __future__ import annotations
 import asyncio
 from collections.abc import Awaitable, Callable, Coroutine
 from dataclasses import dataclass
+from functools import partial
 import logging
-from typing import Any, TypeVar
+from typing import Any, Literal, TypeVar
 
 from bleak import BleakError
 from improv_ble_client import (
@@ -26,7 +27,9 @@ from homeassistant.components.bluetooth import (
     async_last_service_info,
 )
 from homeassistant.const import CONF_ADDRESS
+from homeassistant.core import callback
 from homeassistant.data_entry_flow import FlowResult
+from homeassistant.util.dt import monotonic_time_coarse
 
 from .const import DOMAIN
 
@@ -34,6 +37,9 @@ _LOGGER = logging.getLogger(__name__)
 
 _T = TypeVar("_T")
 
+# Don't check the advertised state again if it was checked this recently (seconds)
+_STATE_RECHECK_INTERVAL = 2
+
 STEP_PROVISION_SCHEMA = vol.Schema(
     {
         vol.Required("ssid"): str,
@@ -41,16 +47,18 @@ STEP_PROVISION_SCHEMA = vol.Schema(
     }
 )
 
+# Limit concurrent BLE operations across flows to not overload the adapter
+_MAX_CONCURRENT_BLE_OPS = 2
+_DATA_BLE_OP_SEMAPHORE = f"{DOMAIN}_ble_op_semaphore"
 
-class AbortFlow(Exception):
-    """Raised when a flow should be aborted."""
+# Keep clients of removed flows for restarted flows this long (seconds)
+_CLIENT_TTL = 300
+_DATA_CLIENTS = f"{DOMAIN}_clients"
 
-    def __init__(self, reason: str) -> None:
-        """Initialize."""
-        self.reason = reason
+_PROVISIONED_STATES = frozenset((State.PROVISIONING, State.PROVISIONED))
 
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class Credentials:
     """Container for WiFi credentials."""
 
@@ -63,12 +71,15 @@ class ConfigFlow(config_entries.ConfigFlow, domain=DOMAIN):
 
     VERSION = 1
 
-    _authorize_task: asyncio.Task | None = None
+    _authorize_task: asyncio.Task[State] | None = None
+    _authorized = False
     _can_identify: bool | None = None
     _credentials: Credentials | None = None
+    _last_state_check: float = 0
     _provision_result: FlowResult | None = None
     _provision_task: asyncio.Task | None = None
     _reauth_entry: config_entries.ConfigEntry | None = None
+    _removed = False
     _unsub: Callable[[], None] | None = None
 
     def __init__(self) -> None:
@@ -78,6 +89,9 @@ class ConfigFlow(config_entries.ConfigFlow, domain=DOMAIN):
         self._discovered_devices: dict[str, BluetoothServiceInfoBleak] = {}
         # Populated by bluetooth, reauth_confirm and user steps
         self._discovery_info: BluetoothServiceInfoBleak | None = None
+        # Last parsed service data, reused while the advertisement is unchanged
+        self._last_service_data_bytes: bytes | None = None
+        self._last_parsed: ImprovServiceData | None = None
 
     async def async_step_user(
         self, user_input: dict[str, Any] | None = None
@@ -94,15 +108,20 @@ class ConfigFlow(config_entries.ConfigFlow, domain=DOMAIN):
             self._discovery_info = self._discovered_devices[address]
             return await self.async_step_start_improv()
 
-        current_addresses = self._async_current_ids()
+        discovered_devices = self._discovered_devices
+        # Check cheap lookups before the more expensive device_filter
+        skip_addresses = self._async_current_ids()
+        skip_addresses.update(discovered_devices)
         for discovery in async_discovered_service_info(self.hass):
+            address = discovery.address
             if (
-                discovery.address in current_addresses
-                or discovery.address in self._discovered_devices
+                address in skip_addresses
+                or SERVICE_DATA_UUID not in discovery.service_data
                 or not device_filter(discovery.advertisement)
             ):
                 continue
-            self._discovered_devices[discovery.address] = discovery
+            discovered_devices[address] = discovery
+            skip_addresses.add(address)
 
         if not self._discovered_devices:
             return self.async_abort(reason="no_devices_found")
@@ -132,10 +151,8 @@ class ConfigFlow(config_entries.ConfigFlow, domain=DOMAIN):
         await self.async_set_unique_id(discovery_info.address)
         self._abort_if_unique_id_configured()
         service_data = discovery_info.service_data
-        improv_service_data = ImprovServiceData.from_bytes(
-            service_data[SERVICE_DATA_UUID]
-        )
-        if improv_service_data.state in (State.PROVISIONING, State.PROVISIONED):
+        improv_service_data = self._parse_service_data(service_data[SERVICE_DATA_UUID])
+        if improv_service_data.state in _PROVISIONED_STATES:
             _LOGGER.debug(
                 "Device is already provisioned: %s", improv_service_data.state
             )
@@ -169,32 +186,39 @@ class ConfigFlow(config_entries.ConfigFlow, domain=DOMAIN):
         If the device supports identification, show a menu, if it does not,
         ask for WiFi credentials.
         """
-        # mypy is not aware that we can't get here without having these set already
-        assert self._discovery_info is not None
-        discovery_info = self._discovery_info = async_last_service_info(
-            self.hass, self._discovery_info.address
-        )
-        if not discovery_info:
-            return self.async_abort(reason="cannot_connect")
-        service_data = discovery_info.service_data
-        improv_service_data = ImprovServiceData.from_bytes(
-            service_data[SERVICE_DATA_UUID]
-        )
-        if improv_service_data.state in (State.PROVISIONING, State.PROVISIONED):
-            _LOGGER.debug(
-                "Device is already provisioned: %s", improv_service_data.state
+        device = self._device
+        if (
+            device is None
+            or self._can_identify is None
+            or monotonic_time_coarse() - self._last_state_check
+            >= _STATE_RECHECK_INTERVAL
+        ):
+            # mypy is not aware that we can't get here without having these set
+            assert self._discovery_info is not None
+            discovery_info = self._discovery_info = async_last_service_info(
+                self.hass, self._discovery_info.address
             )
-            return self.async_abort(reason="already_provisioned")
+            if not discovery_info:
+                return self.async_abort(reason="cannot_connect")
+            service_data = discovery_info.service_data
+            improv_service_data = self._parse_service_data(
+                service_data[SERVICE_DATA_UUID]
+            )
+            if improv_service_data.state in _PROVISIONED_STATES:
+                _LOGGER.debug(
+                    "Device is already provisioned: %s", improv_service_data.state
+                )
+                return self.async_abort(reason="already_provisioned")
+            self._last_state_check = monotonic_time_coarse()
 
-        if not self._device:
-            self._device = ImprovBLEClient(discovery_info.device)
-        device = self._device
+            if device is None:
+                device = self._device = self._async_get_client(discovery_info)
 
         if self._can_identify is None:
-            try:
-                self._can_identify = await self._try_call(device.can_identify())
-            except AbortFlow as err:
-                return self.async_abort(reason=err.reason)
+            result = await self._try_call(device.can_identify)
+            if not result[0]:
+                return self.async_abort(reason=result[1])
+            self._can_identify = result[1]
         if self._can_identify:
             return await self.async_step_main_menu()
         return await self.async_step_provision()
@@ -217,10 +241,9 @@ class ConfigFlow(config_entries.ConfigFlow, domain=DOMAIN):
         assert self._device is not None
 
         if user_input is None:
-            try:
-                await self._try_call(self._device.identify())
-            except AbortFlow as err:
-                return self.async_abort(reason=err.reason)
+            result = await self._try_call(self._device.identify)
+            if not result[0]:
+                return self.async_abort(reason=result[1])
             return self.async_show_form(step_id="identify")
         return await self.async_step_start_improv()
 
@@ -240,10 +263,14 @@ class ConfigFlow(config_entries.ConfigFlow, domain=DOMAIN):
                 user_input.get("password", ""), user_input["ssid"]
             )
 
-        try:
-            need_authorization = await self._try_call(self._device.need_authorization())
-        except AbortFlow as err:
-            return self.async_abort(reason=err.reason)
+        if self._authorized:
+            # No need to ask the device again, we just waited for authorization
+            return await self.async_step_do_provision()
+
+        result = await self._try_call(self._device.need_authorization)
+        if not result[0]:
+            return self.async_abort(reason=result[1])
+        need_authorization = result[1]
         _LOGGER.debug("Need authorization: %s", need_authorization)
         if need_authorization:
             return await self.async_step_authorize()
@@ -261,17 +288,21 @@ class ConfigFlow(config_entries.ConfigFlow, domain=DOMAIN):
 
             errors = {}
             try:
-                redirect_url = await self._try_call(
-                    self._device.provision(
-                        self._credentials.ssid, self._credentials.password, None
-                    )
+                # Provisioning waits until the device reports a result, don't block
+                # other flows' BLE operations meanwhile
+                result = await self._try_call(
+                    partial(
+                        self._device.provision,
+                        self._credentials.ssid,
+                        self._credentials.password,
+                        None,
+                    ),
+                    limit=False,
                 )
-            except AbortFlow as err:
-                self._provision_result = self.async_abort(reason=err.reason)
-                return
             except improv_ble_errors.ProvisioningFailed as err:
                 if err.error == Error.NOT_AUTHORIZED:
                     _LOGGER.debug("Need authorization when calling provision")
+                    self._authorized = False
                     self._provision_result = await self.async_step_authorize()
                     return
                 if err.error == Error.UNABLE_TO_CONNECT:
@@ -281,15 +312,17 @@ class ConfigFlow(config_entries.ConfigFlow, domain=DOMAIN):
                     self._provision_result = self.async_abort(reason="unknown")
                     return
             else:
+                if not result[0]:
+                    self._provision_result = self.async_abort(reason=result[1])
+                    return
+                redirect_url = result[1]
                 _LOGGER.debug("Provision successful, redirect URL: %s", redirect_url)
                 # Abort all flows in progress with same unique ID
-                for flow in self._async_in_progress(include_uninitialized=True):
-                    flow_unique_id = flow["context"].get("unique_id")
-                    if (
-                        flow["flow_id"] != self.flow_id
-                        and self.unique_id == flow_unique_id
-                    ):
-                        self.hass.config_entries.flow.async_abort(flow["flow_id"])
+                for flow in self._async_in_progress(
+                    include_uninitialized=True,
+                    match_context={"unique_id": self.unique_id},
+                ):
+                    self.hass.config_entries.flow.async_abort(flow["flow_id"])
                 if redirect_url:
                     self._provision_result = self.async_abort(
                         reason="provision_successful_url",
@@ -326,13 +359,63 @@ class ConfigFlow(config_entries.ConfigFlow, domain=DOMAIN):
         self._provision_result = None
         return result
 
-    async def _resume_flow_when_done(self, awaitable: Awaitable) -> None:
+    @callback
+    def _async_get_client(
+        self, discovery_info: BluetoothServiceInfoBleak
+    ) -> ImprovBLEClient:
+        """Return a client for the device, reusing the client of a removed flow.
+
+        The client is taken out of the cache, a flow waiting on the client of
+        another flow would hold up BLE operations of all flows.
+        """
+        clients = self._async_get_cached_clients()
+        if (cached := clients.pop(discovery_info.address, None)) is None:
+            return ImprovBLEClient(discovery_info.device, discovery_info.advertisement)
+        client = cached[0]
+        client.set_ble_device_and_advertisement_data(
+            discovery_info.device, discovery_info.advertisement
+        )
+        return client
+
+    @callback
+    def _async_get_cached_clients(self) -> dict[str, tuple[ImprovBLEClient, float]]:
+        """Return the clients of removed flows, dropping expired clients."""
+        clients: dict[str, tuple[ImprovBLEClient, float]] = self.hass.data.setdefault(
+            _DATA_CLIENTS, {}
+        )
+        now = monotonic_time_coarse()
+        for address, (_, released) in list(clients.items()):
+            if now - released > _CLIENT_TTL:
+                del clients[address]
+        return clients
+
+    def _parse_service_data(self, raw: bytes) -> ImprovServiceData:
+        """Parse Improv service data, reusing the last result if unchanged."""
+        if self._last_parsed is not None and raw == self._last_service_data_bytes:
+            return self._last_parsed
+        self._last_parsed = ImprovServiceData.from_bytes(raw)
+        self._last_service_data_bytes = raw
+        return self._last_parsed
+
+    async def _resume_flow_when_done(self, awaitable: Awaitable[_T]) -> _T:
+        """Await the awaitable, then continue the flow.
+
+        The flow is continued from a new task which is created before this task
+        finishes. It can't be awaited here because the step continuing the flow
+        awaits this task, and continuing from a done callback instead would run
+        after the step waiting for this task has already resumed.
+
+        The flow is not continued if it has been removed meanwhile. This can't rely
+        on the awaitable raising CancelledError, the library translates the
+        cancellation of a call to its own errors.
+        """
         try:
-            await awaitable
+            return await awaitable
         finally:
-            self.hass.async_create_task(
-                self.hass.config_entries.flow.async_configure(flow_id=self.flow_id)
-            )
+            if not self._removed:
+                self.hass.async_create_task(
+                    self.hass.config_entries.flow.async_configure(flow_id=self.flow_id)
+                )
 
     async def async_step_authorize(
         self, user_input: dict[str, Any] | None = None
@@ -343,47 +426,92 @@ class ConfigFlow(config_entries.ConfigFlow, domain=DOMAIN):
 
         _LOGGER.debug("Wait for authorization")
         if not self._authorize_task:
-            authorized_event = asyncio.Event()
+            authorized_future: asyncio.Future[State] = self.hass.loop.create_future()
 
             def on_state_update(state: State) -> None:
                 _LOGGER.debug("State update: %s", state.name)
-                if state != State.AUTHORIZATION_REQUIRED:
-                    authorized_event.set()
-
-            try:
-                self._unsub = await self._try_call(
-                    self._device.subscribe_state_updates(on_state_update)
-                )
-            except AbortFlow as err:
-                return self.async_abort(reason=err.reason)
+                if (
+                    state != State.AUTHORIZATION_REQUIRED
+                    and not authorized_future.done()
+                ):
+                    authorized_future.set_result(state)
+
+            result = await self._try_call(
+                partial(self._device.subscribe_state_updates, on_state_update)
+            )
+            if not result[0]:
+                return self.async_abort(reason=result[1])
+            self._unsub = result[1]
 
             self._authorize_task = self.hass.async_create_task(
-                self._resume_flow_when_done(authorized_event.wait())
+                self._resume_flow_when_done(authorized_future)
             )
             return self.async_show_progress(
                 step_id="authorize", progress_action="authorize"
             )
 
-        await self._authorize_task
+        state = await self._authorize_task
         self._authorize_task = None
         if self._unsub:
             self._unsub()
             self._unsub = None
+        # The wait also ends if the device disconnects, ask the device again then
+        self._authorized = state == State.AUTHORIZED
         return self.async_show_progress_done(next_step_id="provision")
 
-    @staticmethod
-    async def _try_call(func: Coroutine[Any, Any, _T]) -> _T:
-        """Call the library and abort flow on common errors."""
+    @callback
+    def async_remove(self) -> None:
+        """Notification that the flow has been removed."""
+        self._removed = True
+        if self._unsub:
+            self._unsub()
+            self._unsub = None
+        for task in (self._authorize_task, self._provision_task):
+            if task and not task.done():
+                task.cancel()
+        if self._device:
+            # Keep the client around for a restarted flow
+            self._async_get_cached_clients()[self._device.address] = (
+                self._device,
+                monotonic_time_coarse(),
+            )
+
+    @callback
+    def _async_get_ble_op_semaphore(self) -> asyncio.Semaphore:
+        """Return the semaphore limiting concurrent BLE operations."""
+        if (semaphore := self.hass.data.get(_DATA_BLE_OP_SEMAPHORE)) is None:
+            semaphore = self.hass.data[_DATA_BLE_OP_SEMAPHORE] = asyncio.Semaphore(
+                _MAX_CONCURRENT_BLE_OPS
+            )
+        return semaphore
+
+    async def _try_call(
+        self, func: Callable[[], Coroutine[Any, Any, _T]], *, limit: bool = True
+    ) -> tuple[Literal[True], _T] | tuple[Literal[False], str]:
+        """Call the library and translate common errors.
+
+        If limit is True, the call waits for its turn among the BLE operations of
+        all flows before it is started.
+
+        Returns (True, result) on success or (False, abort reason) on failure.
+        """
         try:
-            return await func
+            if limit:
+                async with self._async_get_ble_op_semaphore():
+                    return True, await func()
+            return True, await func()
         except BleakError as err:
             _LOGGER.warning("BleakError", exc_info=err)
-            raise AbortFlow("cannot_connect") from err
+            return False, "cannot_connect"
         except improv_ble_errors.CharacteristicMissingError as err:
             _LOGGER.warning("CharacteristicMissing", exc_info=err)
-            raise AbortFlow("characteristic_missing") from err
+            return False, "characteristic_missing"
         except improv_ble_errors.CommandFailed:
             raise
-        except Exception as err:  # pylint: disable=broad-except
+        except Exception:  # pylint: disable=broad-except
+            if self._removed:
+                # The call was cancelled because the flow has been removed
+                _LOGGER.debug("Call aborted, the flow has been removed")
+                return False, "unknown"
             _LOGGER.exception("Unexpected exception")
-            raise AbortFlow("unknown") from err
+            return False, "unknown"
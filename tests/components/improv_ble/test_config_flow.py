@@ -1,9 +1,12 @@
 """Test the Improv via BLE config flow."""
+import asyncio
 from collections.abc import Callable
-from unittest.mock import patch
+import gc
+from unittest.mock import Mock, patch
+import weakref
 
 from bleak.exc import BleakError
-from improv_ble_client import Error, State, errors as improv_ble_errors
+from improv_ble_client import Error, ImprovBLEClient, State, errors as improv_ble_errors
 import pytest
 
 from homeassistant import config_entries
@@ -227,6 +230,62 @@ async def test_bluetooth_step_success_identify(hass: HomeAssistant) -> None:
         )
 
 
+async def test_identify_rechecks_state_after_interval(hass: HomeAssistant) -> None:
+    """Test the advertised state is only checked again after the recheck interval."""
+    result = await hass.config_entries.flow.async_init(
+        DOMAIN,
+        context={"source": config_entries.SOURCE_BLUETOOTH},
+        data=IMPROV_BLE_DISCOVERY_INFO,
+    )
+    assert result["type"] == FlowResultType.FORM
+    assert result["step_id"] == "bluetooth_confirm"
+
+    with patch(
+        f"{IMPROV_BLE}.config_flow.async_last_service_info",
+        return_value=IMPROV_BLE_DISCOVERY_INFO,
+    ), patch(
+        f"{IMPROV_BLE}.config_flow.ImprovBLEClient.can_identify", return_value=True
+    ), patch(
+        f"{IMPROV_BLE}.config_flow.monotonic_time_coarse", return_value=100
+    ):
+        result = await hass.config_entries.flow.async_configure(result["flow_id"], {})
+    assert result["type"] == FlowResultType.MENU
+    assert result["step_id"] == "main_menu"
+
+    with patch(f"{IMPROV_BLE}.config_flow.ImprovBLEClient.identify"):
+        result = await hass.config_entries.flow.async_configure(
+            result["flow_id"],
+            {"next_step_id": "identify"},
+        )
+    assert result["type"] == FlowResultType.FORM
+    assert result["step_id"] == "identify"
+
+    # The device is now provisioned, but the state was checked recently
+    with patch(
+        f"{IMPROV_BLE}.config_flow.async_last_service_info",
+        return_value=PROVISIONED_IMPROV_BLE_DISCOVERY_INFO,
+    ), patch(f"{IMPROV_BLE}.config_flow.monotonic_time_coarse", return_value=101):
+        result = await hass.config_entries.flow.async_configure(result["flow_id"], {})
+    assert result["type"] == FlowResultType.MENU
+    assert result["step_id"] == "main_menu"
+
+    with patch(f"{IMPROV_BLE}.config_flow.ImprovBLEClient.identify"):
+        result = await hass.config_entries.flow.async_configure(
+            result["flow_id"],
+            {"next_step_id": "identify"},
+        )
+    assert result["type"] == FlowResultType.FORM
+    assert result["step_id"] == "identify"
+
+    with patch(
+        f"{IMPROV_BLE}.config_flow.async_last_service_info",
+        return_value=PROVISIONED_IMPROV_BLE_DISCOVERY_INFO,
+    ), patch(f"{IMPROV_BLE}.config_flow.monotonic_time_coarse", return_value=102):
+        result = await hass.config_entries.flow.async_configure(result["flow_id"], {})
+    assert result["type"] == FlowResultType.ABORT
+    assert result["reason"] == "already_provisioned"
+
+
 async def _test_common_success_with_identify(
     hass: HomeAssistant, result: FlowResult, address: str
 ) -> None:
@@ -376,7 +435,7 @@ async def _test_common_success_w_authorize(
     with patch(
         f"{IMPROV_BLE}.config_flow.ImprovBLEClient.need_authorization",
         return_value=False,
-    ), patch(
+    ) as mock_need_authorization, patch(
         f"{IMPROV_BLE}.config_flow.ImprovBLEClient.provision",
         return_value="http://blabla.local",
     ) as mock_provision:
@@ -384,6 +443,7 @@ async def _test_common_success_w_authorize(
         assert result["type"] == FlowResultType.SHOW_PROGRESS
         assert result["progress_action"] == "provisioning"
         assert result["step_id"] == "do_provision"
+        mock_need_authorization.assert_not_awaited()
 
         result = await hass.config_entries.flow.async_configure(result["flow_id"])
         assert result["type"] == FlowResultType.SHOW_PROGRESS_DONE
@@ -397,6 +457,335 @@ async def _test_common_success_w_authorize(
     mock_provision.assert_awaited_once_with("MyWIFI", "secret", None)
 
 
+async def test_authorize_disconnected(hass: HomeAssistant) -> None:
+    """Test authorization is checked again if the device disconnects."""
+    result = await hass.config_entries.flow.async_init(
+        DOMAIN,
+        context={"source": config_entries.SOURCE_BLUETOOTH},
+        data=IMPROV_BLE_DISCOVERY_INFO,
+    )
+    assert result["type"] == FlowResultType.FORM
+    assert result["step_id"] == "bluetooth_confirm"
+
+    with patch(
+        f"{IMPROV_BLE}.config_flow.async_last_service_info",
+        return_value=IMPROV_BLE_DISCOVERY_INFO,
+    ), patch(
+        f"{IMPROV_BLE}.config_flow.ImprovBLEClient.can_identify", return_value=False
+    ):
+        result = await hass.config_entries.flow.async_configure(result["flow_id"], {})
+    assert result["type"] == FlowResultType.FORM
+    assert result["step_id"] == "provision"
+
+    async def subscribe_state_updates(
+        state_callback: Callable[[State], None]
+    ) -> Callable[[], None]:
+        state_callback(State.DISCONNECTED)
+        return lambda: None
+
+    with patch(
+        f"{IMPROV_BLE}.config_flow.ImprovBLEClient.need_authorization",
+        return_value=True,
+    ), patch(
+        f"{IMPROV_BLE}.config_flow.ImprovBLEClient.subscribe_state_updates",
+        side_effect=subscribe_state_updates,
+    ):
+        result = await hass.config_entries.flow.async_configure(
+            result["flow_id"], {"ssid": "MyWIFI", "password": "secret"}
+        )
+        assert result["type"] == FlowResultType.SHOW_PROGRESS
+        assert result["step_id"] == "authorize"
+
+        result = await hass.config_entries.flow.async_configure(result["flow_id"])
+        assert result["type"] == FlowResultType.SHOW_PROGRESS_DONE
+        assert result["step_id"] == "provision"
+
+    with patch(
+        f"{IMPROV_BLE}.config_flow.ImprovBLEClient.need_authorization",
+        return_value=True,
+    ) as mock_need_authorization, patch(
+        f"{IMPROV_BLE}.config_flow.ImprovBLEClient.subscribe_state_updates",
+        side_effect=subscribe_state_updates,
+    ), patch(
+        f"{IMPROV_BLE}.config_flow.ImprovBLEClient.provision"
+    ) as mock_provision:
+        result = await hass.config_entries.flow.async_configure(result["flow_id"])
+        assert result["type"] == FlowResultType.SHOW_PROGRESS
+        assert result["step_id"] == "authorize"
+        mock_need_authorization.assert_awaited_once()
+        mock_provision.assert_not_called()
+
+        hass.config_entries.flow.async_abort(result["flow_id"])
+        await hass.async_block_till_done()
+
+
+async def test_authorize_flow_removed(hass: HomeAssistant) -> None:
+    """Test state updates are unsubscribed when the flow is removed."""
+    result = await hass.config_entries.flow.async_init(
+        DOMAIN,
+        context={"source": config_entries.SOURCE_BLUETOOTH},
+        data=IMPROV_BLE_DISCOVERY_INFO,
+    )
+    assert result["type"] == FlowResultType.FORM
+    assert result["step_id"] == "bluetooth_confirm"
+
+    with patch(
+        f"{IMPROV_BLE}.config_flow.async_last_service_info",
+        return_value=IMPROV_BLE_DISCOVERY_INFO,
+    ), patch(
+        f"{IMPROV_BLE}.config_flow.ImprovBLEClient.can_identify", return_value=False
+    ):
+        result = await hass.config_entries.flow.async_configure(result["flow_id"], {})
+    assert result["type"] == FlowResultType.FORM
+    assert result["step_id"] == "provision"
+
+    unsub = Mock()
+    with patch(
+        f"{IMPROV_BLE}.config_flow.ImprovBLEClient.need_authorization",
+        return_value=True,
+    ), patch(
+        f"{IMPROV_BLE}.config_flow.ImprovBLEClient.subscribe_state_updates",
+        return_value=unsub,
+    ):
+        result = await hass.config_entries.flow.async_configure(
+            result["flow_id"], {"ssid": "MyWIFI", "password": "secret"}
+        )
+    assert result["type"] == FlowResultType.SHOW_PROGRESS
+    assert result["step_id"] == "authorize"
+
+    hass.config_entries.flow.async_abort(result["flow_id"])
+    await hass.async_block_till_done()
+
+    unsub.assert_called_once_with()
+    assert not hass.config_entries.flow.async_progress(DOMAIN)
+
+
+async def test_provision_flow_removed(
+    hass: HomeAssistant, caplog: pytest.LogCaptureFixture
+) -> None:
+    """Test a removed flow isn't continued when provisioning is cancelled."""
+    result = await hass.config_entries.flow.async_init(
+        DOMAIN,
+        context={"source": config_entries.SOURCE_BLUETOOTH},
+        data=IMPROV_BLE_DISCOVERY_INFO,
+    )
+    assert result["type"] == FlowResultType.FORM
+    assert result["step_id"] == "bluetooth_confirm"
+
+    with patch(
+        f"{IMPROV_BLE}.config_flow.async_last_service_info",
+        return_value=IMPROV_BLE_DISCOVERY_INFO,
+    ), patch(
+        f"{IMPROV_BLE}.config_flow.ImprovBLEClient.can_identify", return_value=False
+    ):
+        result = await hass.config_entries.flow.async_configure(result["flow_id"], {})
+    assert result["type"] == FlowResultType.FORM
+    assert result["step_id"] == "provision"
+
+    # The device never responds, the library translates the cancellation of
+    # provision to its own error
+    with patch(
+        f"{IMPROV_BLE}.config_flow.ImprovBLEClient.need_authorization",
+        return_value=False,
+    ), patch(f"{IMPROV_BLE}.config_flow.ImprovBLEClient._ensure_connected"), patch(
+        f"{IMPROV_BLE}.config_flow.ImprovBLEClient.send_cmd"
+    ):
+        result = await hass.config_entries.flow.async_configure(
+            result["flow_id"], {"ssid": "MyWIFI", "password": "secret"}
+        )
+        assert result["type"] == FlowResultType.SHOW_PROGRESS
+        assert result["step_id"] == "do_provision"
+        for _ in range(10):
+            await asyncio.sleep(0)
+
+        with patch.object(
+            hass.config_entries.flow,
+            "async_configure",
+            wraps=hass.config_entries.flow.async_configure,
+        ) as mock_configure:
+            hass.config_entries.flow.async_abort(result["flow_id"])
+            await hass.async_block_till_done()
+
+    mock_configure.assert_not_called()
+    assert "Unexpected exception" not in caplog.text
+    assert not hass.config_entries.flow.async_progress(DOMAIN)
+
+
+async def _start_and_abort_flow(hass: HomeAssistant) -> weakref.ref[ImprovBLEClient]:
+    """Start a flow until it has a client for the device, then abort it.
+
+    Returns a weak reference to the client used by the flow.
+    """
+    result = await hass.config_entries.flow.async_init(
+        DOMAIN,
+        context={"source": config_entries.SOURCE_BLUETOOTH},
+        data=IMPROV_BLE_DISCOVERY_INFO,
+    )
+    assert result["type"] == FlowResultType.FORM
+    assert result["step_id"] == "bluetooth_confirm"
+
+    with patch(
+        f"{IMPROV_BLE}.config_flow.async_last_service_info",
+        return_value=IMPROV_BLE_DISCOVERY_INFO,
+    ), patch(
+        f"{IMPROV_BLE}.config_flow.ImprovBLEClient.can_identify",
+        return_value=False,
+    ):
+        result = await hass.config_entries.flow.async_configure(result["flow_id"], {})
+    assert result["type"] == FlowResultType.FORM
+    assert result["step_id"] == "provision"
+
+    client = weakref.ref(hass.config_entries.flow._progress[result["flow_id"]]._device)
+    hass.config_entries.flow.async_abort(result["flow_id"])
+    await hass.async_block_till_done()
+    gc.collect()
+    return client
+
+
+async def test_restarted_flow_reuses_client(hass: HomeAssistant) -> None:
+    """Test a restarted flow reuses the client for the device."""
+    with patch(f"{IMPROV_BLE}.config_flow.monotonic_time_coarse", return_value=1000):
+        first_client = await _start_and_abort_flow(hass)
+    assert first_client() is not None
+
+    with patch(f"{IMPROV_BLE}.config_flow.monotonic_time_coarse", return_value=1200):
+        second_client = await _start_and_abort_flow(hass)
+    assert second_client() is first_client()
+
+
+async def test_restarted_flow_client_expired(hass: HomeAssistant) -> None:
+    """Test a restarted flow creates a new client once the cached one expired."""
+    with patch(f"{IMPROV_BLE}.config_flow.monotonic_time_coarse", return_value=1000):
+        first_client = await _start_and_abort_flow(hass)
+
+    with patch(f"{IMPROV_BLE}.config_flow.monotonic_time_coarse", return_value=1301):
+        second_client = await _start_and_abort_flow(hass)
+    assert second_client() is not None
+    assert first_client() is None
+
+
+async def test_ble_operations_limited(hass: HomeAssistant) -> None:
+    """Test concurrent BLE operations from several flows are limited."""
+    running = 0
+    max_running = 0
+    release = asyncio.Event()
+
+    async def can_identify() -> bool:
+        nonlocal running, max_running
+        running += 1
+        max_running = max(max_running, running)
+        await release.wait()
+        running -= 1
+        return False
+
+    flow_ids = []
+    with patch(
+        f"{IMPROV_BLE}.config_flow.async_discovered_service_info",
+        return_value=[IMPROV_BLE_DISCOVERY_INFO],
+    ):
+        for _ in range(3):
+            result = await hass.config_entries.flow.async_init(
+                DOMAIN, context={"source": config_entries.SOURCE_USER}
+            )
+            assert result["type"] == FlowResultType.FORM
+            flow_ids.append(result["flow_id"])
+
+    with patch(
+        f"{IMPROV_BLE}.config_flow.async_last_service_info",
+        return_value=IMPROV_BLE_DISCOVERY_INFO,
+    ), patch(
+        f"{IMPROV_BLE}.config_flow.ImprovBLEClient.can_identify",
+        side_effect=can_identify,
+    ):
+        tasks = [
+            hass.async_create_task(
+                hass.config_entries.flow.async_configure(
+                    flow_id, {CONF_ADDRESS: IMPROV_BLE_DISCOVERY_INFO.address}
+                )
+            )
+            for flow_id in flow_ids
+        ]
+        for _ in range(10):
+            await asyncio.sleep(0)
+        running_before_release = running
+
+        release.set()
+        results = await asyncio.gather(*tasks)
+
+    assert running_before_release == 2
+    assert max_running == 2
+    for result in results:
+        assert result["type"] == FlowResultType.FORM
+        assert result["step_id"] == "provision"
+
+
+async def test_provisioning_flow_does_not_block_other_flows(
+    hass: HomeAssistant,
+) -> None:
+    """Test flows for a device don't wait on a flow provisioning the device."""
+    flow_ids = []
+    with patch(
+        f"{IMPROV_BLE}.config_flow.async_discovered_service_info",
+        return_value=[IMPROV_BLE_DISCOVERY_INFO],
+    ):
+        for _ in range(3):
+            result = await hass.config_entries.flow.async_init(
+                DOMAIN, context={"source": config_entries.SOURCE_USER}
+            )
+            assert result["type"] == FlowResultType.FORM
+            flow_ids.append(result["flow_id"])
+
+    # The device never responds to the provision command, the first flow keeps
+    # waiting while holding its client
+    with patch(
+        f"{IMPROV_BLE}.config_flow.async_last_service_info",
+        return_value=IMPROV_BLE_DISCOVERY_INFO,
+    ), patch(
+        f"{IMPROV_BLE}.config_flow.ImprovBLEClient.can_identify", return_value=False
+    ), patch(
+        f"{IMPROV_BLE}.config_flow.ImprovBLEClient._ensure_connected"
+    ), patch(
+        f"{IMPROV_BLE}.config_flow.ImprovBLEClient.read_characteristic",
+        return_value=State.AUTHORIZED,
+    ), patch(
+        f"{IMPROV_BLE}.config_flow.ImprovBLEClient.send_cmd"
+    ):
+        for flow_id in flow_ids:
+            result = await hass.config_entries.flow.async_configure(
+                flow_id, {CONF_ADDRESS: IMPROV_BLE_DISCOVERY_INFO.address}
+            )
+            assert result["type"] == FlowResultType.FORM
+            assert result["step_id"] == "provision"
+
+        result = await hass.config_entries.flow.async_configure(
+            flow_ids[0], {"ssid": "MyWIFI", "password": "secret"}
+        )
+        assert result["type"] == FlowResultType.SHOW_PROGRESS
+        assert result["step_id"] == "do_provision"
+
+        tasks = [
+            hass.async_create_task(
+                hass.config_entries.flow.async_configure(
+                    flow_id, {"ssid": "MyWIFI", "password": "secret"}
+                )
+            )
+            for flow_id in flow_ids[1:]
+        ]
+        for _ in range(10):
+            await asyncio.sleep(0)
+        done = [task.done() for task in tasks]
+
+        for flow_id in flow_ids:
+            hass.config_entries.flow.async_abort(flow_id)
+        for task in tasks:
+            task.cancel()
+        await hass.async_block_till_done()
+
+    assert done == [True, True]
+    for task in tasks:
+        assert task.result()["step_id"] == "do_provision"
+
+
 async def test_bluetooth_step_already_in_progress(hass: HomeAssistant) -> None:
     """Test we can't start a flow for the same device twice."""
     result = await hass.config_entries.flow.async_init(